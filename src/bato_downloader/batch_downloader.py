@@ -1,217 +1,395 @@
 import os
-import time
 import json
+import atexit
+import logging
+import logging.handlers
 import queue
+import sys
 import threading
-from concurrent.futures import ThreadPoolExecutor
-from bato_scraper import get_manga_info, download_chapter, sanitize_filename
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    # When running as part of the package (PyPI)
+    from .bato_scraper import (
+        create_session,
+        AdaptiveLimiter,
+        get_manga_info,
+        download_chapter,
+        sanitize_filename,
+    )
+except ImportError:
+    # When frozen to EXE or run directly
+    from bato_scraper import (
+        create_session,
+        AdaptiveLimiter,
+        get_manga_info,
+        download_chapter,
+        sanitize_filename,
+    )
+
+try:
+    import ijson
+except ImportError:  # optional: stream-parse large failure logs
+    ijson = None
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
 
 # --- CONFIG ---
 INPUT_FILE = "series_list.txt"   # one series URL per line
 OUTPUT_DIR = "output"            # root output folder
 MAX_WORKERS = 10                 # threads for images per chapter
-RETRY_DELAY = 10                 # seconds before retry
+CHAPTER_WORKERS = 4              # chapter download slots per series worker
+SERIES_WORKERS = 2               # series downloaded at once
 FAILED_LOG = "failed_chapters.json"
+FAILED_FLUSH_EVERY = 25          # failures buffered before rewriting FAILED_LOG
+DONE_CACHE = os.path.join(OUTPUT_DIR, ".done.json")  # URLs of finished chapters
+DONE_FLUSH_EVERY = 100           # finished chapters between DONE_CACHE writes
 # ---------------
 
-# Queue for finished chapters (to be converted)
-chapter_queue = queue.Queue()
-stop_event = threading.Event()
+# Workers only enqueue log records; a QueueListener (started in __main__)
+# formats and writes them from a single thread
+logger = logging.getLogger("bato")
+
+# Batch runs never cancel a chapter, so every download shares one idle event
+_NEVER_STOP = threading.Event()
+
+# Every chapter thread and image thread may hold a connection at once, so the
+# session's pool is sized to match and urllib3 never discards keep-alives
+session = create_session(
+    pool_size=SERIES_WORKERS * CHAPTER_WORKERS * (MAX_WORKERS + 1),
+    retry_throttled=False,  # let the limiter below handle 429/503
+)
+
+# Shared cap on in-flight requests; shrinks under HTTP 429/503 and recovers
+# on sustained success instead of sleeping a fixed delay after each series
+limiter = AdaptiveLimiter(SERIES_WORKERS * CHAPTER_WORKERS * MAX_WORKERS)
+
+# One long-lived pool runs chapter downloads for every series, so idle
+# chapter slots from one series can be used by another
+chapter_pool = ThreadPoolExecutor(max_workers=SERIES_WORKERS * CHAPTER_WORKERS)
+
+# One long-lived pool serves image fetches for every chapter, instead of each
+# chapter starting and tearing down its own MAX_WORKERS threads
+image_pool = ThreadPoolExecutor(max_workers=SERIES_WORKERS * CHAPTER_WORKERS * MAX_WORKERS)
+
+# Directories already created by this process
+_MADE_DIRS = set()
+
+# Chapter URLs whose CBZ has been written, persisted to DONE_CACHE
+_done_urls = set()
+_done_dirty = False
+_done_pending = 0  # additions since the last write
+_done_lock = threading.Lock()
+
+# Failures are buffered in memory and written to FAILED_LOG in batches
+_failed_records = []
+_failed_dirty = False
+_failed_lock = threading.Lock()
 
 
 def load_failed_chapters():
-    if os.path.exists(FAILED_LOG):
+    """Yield failed chapter records from FAILED_LOG one at a time."""
+    if not os.path.exists(FAILED_LOG) or os.path.getsize(FAILED_LOG) == 0:
+        return
+    if ijson is None:
         with open(FAILED_LOG, "r", encoding="utf-8") as f:
             try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return []
-    return []
+                records = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{FAILED_LOG} is corrupt: {e}") from e
+        yield from records
+        return
+    with open(FAILED_LOG, "rb") as f:
+        try:
+            yield from ijson.items(f, "item")
+        except ijson.JSONError as e:
+            raise ValueError(f"{FAILED_LOG} is corrupt: {e}") from e
+
+
+def _dump_json(obj):
+    """Serialize obj to compact UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _atomic_write(path, data):
+    """Write data to path via a temp file so a crash never leaves it half-written."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
 
 
 def save_failed_chapters(failed):
     if not failed:
         return
-    with open(FAILED_LOG, "w", encoding="utf-8") as f:
-        json.dump(failed, f, indent=2, ensure_ascii=False)
+    _atomic_write(FAILED_LOG, _dump_json(failed))
+
+
+def record_failed(entry):
+    """Buffer a failed chapter, flushing to disk every FAILED_FLUSH_EVERY entries."""
+    global _failed_dirty
+    with _failed_lock:
+        _failed_records.append(entry)
+        _failed_dirty = True
+        if len(_failed_records) % FAILED_FLUSH_EVERY == 0:
+            save_failed_chapters(_failed_records)
+            _failed_dirty = False
+
+
+def flush_failed():
+    """Write any buffered failures to FAILED_LOG."""
+    global _failed_dirty
+    with _failed_lock:
+        if _failed_dirty:
+            save_failed_chapters(_failed_records)
+            _failed_dirty = False
+
+
+atexit.register(flush_failed)
+
+
+def load_done_urls():
+    """Load the set of completed chapter URLs from DONE_CACHE."""
+    if not os.path.exists(DONE_CACHE):
+        return set()
+    with open(DONE_CACHE, "r", encoding="utf-8") as f:
+        try:
+            return set(json.load(f))
+        except json.JSONDecodeError:
+            return set()
+
+
+def mark_done(chapter_url):
+    """Record a chapter as finished so later runs skip it."""
+    global _done_dirty, _done_pending
+    with _done_lock:
+        _done_urls.add(chapter_url)
+        _done_dirty = True
+        _done_pending += 1
+        if _done_pending >= DONE_FLUSH_EVERY:
+            _write_done_urls()
+
+
+def _write_done_urls():
+    global _done_dirty, _done_pending
+    ensure_dir(OUTPUT_DIR)
+    _atomic_write(DONE_CACHE, _dump_json(sorted(_done_urls)))
+    _done_dirty = False
+    _done_pending = 0
+
+
+def save_done_urls():
+    """Write the completed chapter URLs to DONE_CACHE if they changed."""
+    with _done_lock:
+        if _done_dirty:
+            _write_done_urls()
+
+
+atexit.register(save_done_urls)
+
+
+def ensure_dir(path):
+    """Create path once per process, skipping the syscall on later calls."""
+    if path not in _MADE_DIRS:
+        os.makedirs(path, exist_ok=True)
+        _MADE_DIRS.add(path)
 
 
 def read_series_urls():
     with open(INPUT_FILE, "r", encoding="utf-8") as f:
-        return [line.strip() for line in f if line.strip()]
+        return [url for line in f.read().splitlines() if (url := line.strip())]
 
 
 def download_series(series_url):
-    print("=" * 80)
-    print(f"Fetching manga info: {series_url}")
-    print("=" * 80)
+    logger.info("=" * 80)
+    logger.info(f"Fetching manga info: {series_url}")
+    logger.info("=" * 80)
 
     try:
-        manga_title, chapters = get_manga_info(series_url)
+        manga_title, chapters = get_manga_info(series_url, session=session)
     except Exception as e:
-        print(f"Error fetching series info: {e}")
+        logger.error(f"Error fetching series info: {e}")
         return []
 
     if not chapters:
-        print("No chapters found.")
+        logger.info("No chapters found.")
         return []
 
     manga_sanitized = sanitize_filename(manga_title)
     series_dir = os.path.join(OUTPUT_DIR, manga_sanitized)
-    os.makedirs(series_dir, exist_ok=True)
+    ensure_dir(series_dir)
 
     failed = []
     total = len(chapters)
     pad_length = len(str(total))
 
-    for index, chapter in enumerate(chapters,start=1):
-        prefix = str(index).zfill(pad_length)
-        clean_title = sanitize_filename(chapter["title"])
-        numbered_title = f"{prefix}_{clean_title}"
+    futures = {
+        chapter_pool.submit(
+            _download_one_chapter,
+            chapter,
+            index,
+            total,
+            pad_length,
+            manga_title,
+            series_dir,
+        ): chapter
+        for index, chapter in enumerate(chapters, start=1)
+        if chapter["url"] not in _done_urls
+    }
+    for future in as_completed(futures):
+        result = future.result()
+        if result is None:
+            continue
+        failed.append(result)
+        record_failed(result)
+
+    flush_failed()
+    return failed
 
-        print(f"\n[{index + 1}/{total}] Downloading: {numbered_title}")
 
-        try:
+def download_to_cbz(chapter_url, manga_title, chapter_title, chapter_dir):
+    """Download a chapter straight into chapter_dir + ".cbz".
+
+    Pages are written into a temporary archive that only replaces the real CBZ
+    once every page has been downloaded; download_chapter raises if any page
+    fails, so the chapter goes to FAILED_LOG instead of being marked done.
+    JPEG/PNG pages are already compressed, so they are stored rather than
+    deflated.
+    """
+    cbz_path = chapter_dir + ".cbz"
+    part_path = cbz_path + ".part"
+    try:
+        with zipfile.ZipFile(part_path, "w", zipfile.ZIP_STORED) as cbz_file:
             download_chapter(
-                chapter_url=chapter["url"],
+                chapter_url=chapter_url,
                 manga_title=manga_title,
-                chapter_title=numbered_title,
+                chapter_title=chapter_title,
                 output_dir=OUTPUT_DIR,
-                stop_event=threading.Event(),
-                convert_to_pdf=False,
-                convert_to_cbz=False,   # let queue handle conversion
-                keep_images=True,       # converter needs images
+                stop_event=_NEVER_STOP,
                 max_workers=MAX_WORKERS,
+                session=session,
+                limiter=limiter,
+                executor=image_pool,
+                zip_target=cbz_file,
             )
-            chapter_dir = os.path.join(
-                OUTPUT_DIR,
-                sanitize_filename(manga_title),
-                sanitize_filename(numbered_title),
-            )
-            chapter_queue.put(
-                {
-                    "chapter_dir": chapter_dir,
-                    "manga_title": manga_title,
-                    "chapter_title": numbered_title,
-                }
-            )
-        except Exception as e:
-            print(f"Failed to download {numbered_title}: {e}")
-            failed.append(
-                {
-                    "manga_title": manga_title,
-                    "chapter_title": numbered_title,
-                    "chapter_url": chapter["url"],
-                }
-            )
-            save_failed_chapters(failed)
-            continue
+            pages = [n for n in cbz_file.namelist() if n != "ComicInfo.xml"]
+        if not pages:
+            raise RuntimeError("no pages downloaded")
+        os.replace(part_path, cbz_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    mark_done(chapter_url)
 
-    return failed
 
+def _download_one_chapter(chapter, index, total, pad_length, manga_title, series_dir):
+    """Download a single chapter into its CBZ.
+
+    Returns None on success, or a failure record for the retry log.
+    """
+    clean_title = sanitize_filename(chapter["title"])
+    numbered_title = f"{index:0{pad_length}d}_{clean_title}"
+    chapter_dir = os.path.join(series_dir, sanitize_filename(numbered_title))
+
+    if os.path.exists(chapter_dir + ".cbz"):
+        logger.info(f"[{index}/{total}] Already downloaded: {numbered_title}")
+        mark_done(chapter["url"])
+        return None
+
+    logger.info(f"[{index}/{total}] Downloading: {numbered_title}")
+
+    try:
+        download_to_cbz(chapter["url"], manga_title, numbered_title, chapter_dir)
+    except Exception as e:
+        logger.error(f"Failed to download {numbered_title}: {e}")
+        return {
+            "manga_title": manga_title,
+            "chapter_title": numbered_title,
+            "chapter_url": chapter["url"],
+        }
+    return None
 
-def retry_failed():
-    failed = load_failed_chapters()
-    if not failed:
-        print("No failed chapters to retry.")
-        return
 
-    print(f"\nRetrying {len(failed)} failed chapters...")
+def retry_failed():
+    global _failed_dirty
     new_failed = []
+    retried = 0
 
-    for chap in failed:
-        try:
-            download_chapter(
-                chapter_url=chap["chapter_url"],
-                manga_title=chap["manga_title"],
-                chapter_title=chap["chapter_title"],
-                output_dir=OUTPUT_DIR,
-                stop_event=threading.Event(),
-                convert_to_pdf=False,
-                convert_to_cbz=False,  # queue will convert
-                keep_images=True,
-                max_workers=MAX_WORKERS,
-            )
-            chapter_dir = os.path.join(
-                OUTPUT_DIR,
-                sanitize_filename(chap["manga_title"]),
-                sanitize_filename(chap["chapter_title"]),
-            )
-            chapter_queue.put(
-                {
-                    "chapter_dir": chapter_dir,
-                    "manga_title": chap["manga_title"],
-                    "chapter_title": chap["chapter_title"],
-                }
-            )
-        except Exception as e:
-            print(f"Retry failed for {chap['chapter_title']}: {e}")
-            new_failed.append(chap)
-            continue
+    try:
+        for chap in load_failed_chapters():
+            if retried == 0:
+                logger.info("Retrying failed chapters...")
+            retried += 1
+            if chap["chapter_url"] in _done_urls:
+                continue
+            try:
+                series_dir = os.path.join(OUTPUT_DIR, sanitize_filename(chap["manga_title"]))
+                ensure_dir(series_dir)
+                chapter_dir = os.path.join(series_dir, sanitize_filename(chap["chapter_title"]))
+                download_to_cbz(
+                    chap["chapter_url"], chap["manga_title"], chap["chapter_title"], chapter_dir
+                )
+            except Exception as e:
+                logger.error(f"Retry failed for {chap['chapter_title']}: {e}")
+                new_failed.append(chap)
+                continue
+    except ValueError as e:
+        # Records past the parse error were never read, so rewriting the log
+        # from new_failed would drop them
+        logger.error(f"{e}. Leaving it unchanged.")
+        return
+
+    if not retried:
+        logger.info("No failed chapters to retry.")
+        return
 
-    save_failed_chapters(new_failed)
+    with _failed_lock:
+        _failed_records[:] = new_failed
+        _failed_dirty = False
+        save_failed_chapters(new_failed)
     if new_failed:
-        print(
-            f"\nStill failed after retry: {len(new_failed)} chapters. Stored in {FAILED_LOG}."
+        logger.info(
+            f"Still failed after retry: {len(new_failed)} chapters. Stored in {FAILED_LOG}."
         )
     else:
-        print("\nAll previously failed chapters retried successfully!")
+        logger.info(f"All {retried} previously failed chapters retried successfully!")
         if os.path.exists(FAILED_LOG):
             os.remove(FAILED_LOG)
 
 
-def converter_worker():
-    """Continuously watches the chapter_queue and converts chapters to CBZ."""
-    from bato_scraper import convert_chapter_to_cbz
-
-    while not stop_event.is_set() or not chapter_queue.empty():
-        try:
-            item = chapter_queue.get(timeout=2)
-        except queue.Empty:
-            continue
-
-        chapter_dir = item["chapter_dir"]
-        manga_title = item["manga_title"]
-        chapter_title = item["chapter_title"]
-
-        try:
-            print(f"Converting to CBZ: {chapter_title}")
-            convert_chapter_to_cbz(
-                chapter_dir, manga_title, chapter_title, delete_images=True
-            )
-            print(f"Converted: {chapter_title}")
-        except Exception as e:
-            print(f"Conversion failed for {chapter_title}: {e}")
-        finally:
-            chapter_queue.task_done()
-
-
 # -------------------------------------------------------------------------
 if __name__ == "__main__":
-    series_urls = read_series_urls()
-    all_failed = []
-
-    # Start converter background thread
-    converter_thread = threading.Thread(target=converter_worker, daemon=True)
-    converter_thread.start()
-
-    SERIES_WORKERS = 2  # how many series at once
-    with ThreadPoolExecutor(max_workers=SERIES_WORKERS) as executor:
-        futures = [executor.submit(download_series, url) for url in series_urls]
-        for future in futures:
-            failed = future.result()
-            if failed:
-                print(
-                    f"\n{len(failed)} failed chapters in this series logged for retry."
-                )
-                all_failed.extend(failed)
-                save_failed_chapters(all_failed)
-                print(f"Waiting {RETRY_DELAY} seconds before continuing...")
-                time.sleep(RETRY_DELAY)
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
 
-    retry_failed()          # retry queue-fed failures
-    chapter_queue.join()    # wait for conversions
-    stop_event.set()
-    converter_thread.join()
-
-    print("\nAll downloads and CBZ conversions complete!")
+    try:
+        series_urls = read_series_urls()
+        _done_urls.update(load_done_urls())
+
+        with ThreadPoolExecutor(max_workers=SERIES_WORKERS) as executor:
+            futures = [executor.submit(download_series, url) for url in series_urls]
+            for future in futures:
+                failed = future.result()
+                if failed:
+                    logger.info(
+                        f"{len(failed)} failed chapters in this series logged for retry."
+                    )
+
+        retry_failed()          # retry logged failures
+        chapter_pool.shutdown()
+        image_pool.shutdown()
+        save_done_urls()
+
+        logger.info("All downloads complete!")
+    finally:
+        listener.stop()
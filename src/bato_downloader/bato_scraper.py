@@ -1,17 +1,41 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup  # type: ignore
 import os
 import re
 import json
 import time # Import time for sleep
+import random
 from concurrent.futures import ThreadPoolExecutor
 import threading
+from functools import lru_cache
 from urllib.parse import quote
 import zipfile
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 
-def search_manga(query, max_pages=5):
+def create_session(pool_size=64, retry_throttled=True):
+    """Create a session whose connection pool keeps pool_size keep-alive
+    connections per host; size it to the number of threads sharing it.
+
+    With retry_throttled=False, 429/503 responses are returned to the caller
+    instead of being retried (and slept on) inside urllib3, so an
+    AdaptiveLimiter can see them and apply its own capped backoff."""
+    status_forcelist = [429, 500, 502, 503, 504] if retry_throttled else [500, 502, 504]
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=status_forcelist),
+    ))
+    return session
+
+# Shared HTTP session so every request reuses pooled keep-alive connections
+# instead of paying a fresh TCP+TLS handshake per page and image.
+SESSION = create_session()
+
+def search_manga(query, max_pages=5, session=SESSION):
     import html
     
     all_results = []
@@ -21,7 +45,7 @@ def search_manga(query, max_pages=5):
         search_url = f"https://bato.to/search?word={quote(query)}&page={page}"
         print(f"Searching page {page}: {search_url}")
         try:
-            response = requests.get(search_url, timeout=10)
+            response = session.get(search_url, timeout=10)
             response.raise_for_status()
         except requests.exceptions.RequestException as e:
             print(f"Error fetching search page {page}: {e}")
@@ -83,10 +107,10 @@ def search_manga(query, max_pages=5):
         time.sleep(1)
     return all_results
 
-def get_manga_info(series_url):
+def get_manga_info(series_url, session=SESSION):
     import html
     
-    response = requests.get(series_url)
+    response = session.get(series_url)
     soup = BeautifulSoup(response.content.decode('utf-8'), 'html.parser')
 
     manga_title_element = soup.find('h3', class_='item-title')
@@ -236,6 +260,7 @@ def convert_chapter_to_cbz(chapter_dir, manga_title, chapter_title, delete_image
         print(f"Error creating CBZ for {chapter_dir}: {e}")
         return None
 
+@lru_cache(maxsize=4096)
 def sanitize_filename(name: str) -> str:
     """Sanitize filename to remove invalid Windows characters and normalize spaces."""
     if not name:
@@ -251,11 +276,141 @@ def sanitize_filename(name: str) -> str:
     # Remove trailing dots, which are invalid in Windows folder names
     return name.rstrip('.')
 
-def download_chapter(chapter_url, manga_title, chapter_title, output_dir=".", stop_event=None, convert_to_pdf=False, convert_to_cbz=False, keep_images=True, max_workers=15):
+class AdaptiveLimiter:
+    """Caps concurrent requests, shrinking the cap when the server throttles us.
+
+    Meant for sessions from create_session(retry_throttled=False), so that
+    HTTP 429/503 responses reach it rather than being retried by urllib3.
+    A throttled request halves the cap and sleeps with jittered exponential
+    backoff; further throttles during that backoff window only sleep, so a
+    burst across many threads counts as one event. After `recover_after`
+    consecutive successes the cap grows back by one, up to `max_concurrency`.
+    """
+
+    def __init__(self, max_concurrency, recover_after=20, max_backoff=60):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.recover_after = recover_after
+        self.max_backoff = max_backoff
+        self._active = 0
+        self._successes = 0
+        self._throttles = 0
+        self._window_end = 0.0  # monotonic time until which throttles don't shrink
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    def succeeded(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.recover_after:
+                self._successes = 0
+                self._throttles = 0
+                if self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._cond.notify()
+
+    def throttled(self, retry_after=None):
+        with self._cond:
+            self._successes = 0
+            now = time.monotonic()
+            shrink = now >= self._window_end
+            if shrink:
+                self._throttles += 1
+                self.limit = max(1, self.limit // 2)
+            # Cap the exponent so a long run of throttles can't overflow float
+            exponent = min(self._throttles, int(self.max_backoff).bit_length())
+            delay = min(self.max_backoff, 2 ** exponent + random.random())
+            if retry_after is not None:
+                delay = min(self.max_backoff, retry_after)
+            if shrink:
+                self._window_end = now + delay
+        time.sleep(delay)
+
+
+def _retry_after(response):
+    """Return the Retry-After header in seconds, if the server sent one."""
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+# Statuses that mean "slow down" rather than "the server is broken"
+THROTTLE_STATUSES = (429, 503)
+THROTTLE_RETRIES = 3  # attempts after a throttled response before giving up
+
+
+def _is_throttle_error(error):
+    """Whether a RetryError ran out of retries on a throttling status."""
+    if error.response is not None:
+        return error.response.status_code in THROTTLE_STATUSES
+    # urllib3 reports "too many <status> error responses" in the reason
+    return any(f"too many {status} error responses" in str(error) for status in THROTTLE_STATUSES)
+
+
+def _get_limited(session, url, limiter):
+    """GET url through the limiter, reporting throttling back to it.
+
+    Raises for any non-2xx response so error pages are never used as content.
+    """
+    if limiter is None:
+        response = session.get(url)
+        response.raise_for_status()
+        return response
+    for attempt in range(THROTTLE_RETRIES + 1):
+        error = None
+        with limiter:
+            try:
+                response = session.get(url)
+            except requests.exceptions.RetryError as e:
+                # The session's own retries were exhausted
+                error = e
+        if error is not None:
+            if _is_throttle_error(error):
+                limiter.throttled()
+            raise error
+        if response.status_code not in THROTTLE_STATUSES:
+            limiter.succeeded()
+            break
+        # Back off outside the limiter so the slot is free while we wait
+        limiter.throttled(_retry_after(response))
+    response.raise_for_status()
+    return response
+
+def _collect_pages(futures):
+    """Wait for every page future, returning (results, failures).
+
+    Results are in page order. Raised pages are counted rather than
+    propagated, so one error doesn't leave the other downloads running
+    unattended.
+    """
+    pages = []
+    failures = 0
+    for future in futures:
+        try:
+            pages.append(future.result())
+        except Exception:
+            failures += 1
+    return pages, failures
+
+def download_chapter(chapter_url, manga_title, chapter_title, output_dir=".", stop_event=None, convert_to_pdf=False, convert_to_cbz=False, keep_images=True, max_workers=15, session=SESSION, limiter=None, executor=None, zip_target=None):
+    # With zip_target (an open zipfile.ZipFile), pages are written into the
+    # archive in page order instead of chapter_dir, and any missing page raises
     if stop_event and stop_event.is_set():
         return # Stop early if signal is already set
 
-    response = requests.get(chapter_url)
+    response = _get_limited(session, chapter_url, limiter)
     soup = BeautifulSoup(response.content.decode('utf-8'), 'html.parser')
 
     # Sanitize both manga_title and chapter_title for use in file paths
@@ -263,7 +418,8 @@ def download_chapter(chapter_url, manga_title, chapter_title, output_dir=".", st
     sanitized_chapter_title = sanitize_filename(chapter_title)
 
     chapter_dir = os.path.join(output_dir, sanitized_manga_title, sanitized_chapter_title)
-    os.makedirs(chapter_dir, exist_ok=True)
+    if zip_target is None:
+        os.makedirs(chapter_dir, exist_ok=True)
 
     image_urls = []
     script_tags = soup.find_all('script')
@@ -279,6 +435,7 @@ def download_chapter(chapter_url, manga_title, chapter_title, output_dir=".", st
 
     if not image_urls:
         print(f"No image URLs found for {chapter_title} at {chapter_url}.")
+        os.makedirs(chapter_dir, exist_ok=True)
         dump_file_path = os.path.join(chapter_dir, f"{sanitized_chapter_title}_dump.html")
         with open(dump_file_path, 'w', encoding='utf-8') as f:
             f.write(str(soup.prettify()))
@@ -294,22 +451,44 @@ def download_chapter(chapter_url, manga_title, chapter_title, output_dir=".", st
 
         if img_url and img_url.startswith('http'):
             try:
-                img_data = requests.get(img_url).content
+                img_data = _get_limited(session, img_url, limiter).content
                 img_extension = img_url.split('.')[-1].split('?')[0]
-                img_path = os.path.join(chapter_dir, f"page_{index+1}.{img_extension}")
-                with open(img_path, 'wb') as handler:
+                img_name = f"page_{index+1}.{img_extension}"
+                if zip_target is not None:
+                    # Written to the archive in page order once all pages are in
+                    return img_name, img_data
+                with open(os.path.join(chapter_dir, img_name), 'wb') as handler:
                     handler.write(img_data)
                 with print_lock:
                     print(f"Downloaded {img_url} to {chapter_dir}")
             except Exception as e:
                 with print_lock:
                     print(f"Error downloading {img_url}: {e}")
-
-    # Use ThreadPoolExecutor for concurrent downloads
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(download_image, img_url, i) for i, img_url in enumerate(image_urls)]
-        for future in futures:
-            future.result() # Ensure all images are downloaded before proceeding
+                if zip_target is not None:
+                    raise
+
+    # Entries that aren't http(s) URLs are skipped, keeping their page numbers
+    page_urls = [(i, img_url) for i, img_url in enumerate(image_urls) if img_url and img_url.startswith('http')]
+
+    # Use a caller-supplied pool if given so many chapters can share one set
+    # of image threads; otherwise spin up a pool for this chapter
+    if executor is not None:
+        futures = [executor.submit(download_image, img_url, i) for i, img_url in page_urls]
+        pages, failures = _collect_pages(futures)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(download_image, img_url, i) for i, img_url in page_urls]
+            pages, failures = _collect_pages(futures)
+
+    if zip_target is not None:
+        if failures:
+            raise RuntimeError(f"{failures} of {len(page_urls)} pages failed to download")
+        if stop_event and stop_event.is_set():
+            raise RuntimeError("download stopped before all pages were fetched")
+        zip_target.writestr("ComicInfo.xml", _create_comic_info_xml(manga_title, chapter_title))
+        for img_name, img_data in pages:
+            zip_target.writestr(img_name, img_data)
+        print(f"Wrote {len(pages)} pages to {zip_target.filename}")
 
     # Handle conversions
     if convert_to_pdf: